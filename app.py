@@ -1,17 +1,59 @@
 from flask import Flask, render_template, request, redirect, url_for, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from datetime import datetime
+from flask_compress import Compress
+from sqlalchemy import event, select, insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from datetime import datetime, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
+import asyncio
 import threading
+import time
 import os
-import random
+import glob
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import sqlite3
+import orjson
 
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///app.db' # Drei Schrägstriche für den relativen Pfad, vier wären absolut
 db = SQLAlchemy(app)
 migrate = Migrate(app, db)
+app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip'] # Diagrammdaten komprimiert ausliefern, Brotli wenn der Browser es kann
+app.config['COMPRESS_MIN_SIZE'] = 500
+Compress(app)
+
+HTTP_TIMEOUT = (3, 5) # (Verbindungsaufbau, Lesen) in Sekunden, damit ein toter Sensor nicht alles blockiert
+HTTP = requests.Session() # Eine Session für alle Anfragen, damit TCP-Verbindungen wiederverwendet werden
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3))
+HTTP.mount("http://", _adapter)
+HTTP.mount("https://", _adapter)
+RELAY_HTTP = requests.Session() # Ohne Wiederholungen, da das Schalten im Request-Handler läuft und ein toter Sensor sonst den Worker lange blockiert
+_relay_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=Retry(total=0))
+RELAY_HTTP.mount("http://", _relay_adapter)
+RELAY_HTTP.mount("https://", _relay_adapter)
+
+_aio_loop = None # Eigener Event-Loop für die Sensorabfragen, damit die aiohttp-Session über mehrere Abfragen bestehen bleibt. Wird erst in get_measurements angelegt, Web-Worker brauchen ihn nicht
+_aio_session = None
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection): # Nur für SQLite, andere Datenbanken kennen keine PRAGMAs
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL") # Leser blockieren den Schreiber nicht mehr
+        cursor.execute("PRAGMA synchronous=NORMAL") # Im WAL-Modus sicher und spart ein fsync pro Commit
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA cache_size=-20000") # Negativ bedeutet KiB, also ca. 20 MB Cache
+        cursor.close()
 
  
 class Home(db.Model):
@@ -33,75 +75,316 @@ class Sensor(db.Model):
     relay_endpoint = db.Column(db.String, nullable=True) # Optionales Feld für den Endpunkt zum Schalten des Relais
     room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
     measurements = db.relationship('Measurement', backref='sensor', cascade="all, delete-orphan")
+    aggregates = db.relationship('MeasurementAggregate', backref='sensor', cascade="all, delete-orphan")
 
 class Measurement(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sensor_id = db.Column(db.Integer, db.ForeignKey('sensor.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.now, nullable=False) # Bei Aufruf wird automatisch die aktuelle Zeit gesetzt, fälschlicherweise habe ich zuerst datetime.now() gebraucht, was nur bei Programmstart gesetzt wird
     values = db.relationship('MeasurementValue', backref='measurement', cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_measurement_sensor_ts', 'sensor_id', 'timestamp'),) # SQLite legt für Fremdschlüssel keinen Index an
 
 class MeasurementType(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String, nullable=False)
     unit = db.Column(db.String, nullable=False)
     values = db.relationship('MeasurementValue', backref='measurement_type', cascade="all, delete-orphan")
+    aggregates = db.relationship('MeasurementAggregate', backref='measurement_type', cascade="all, delete-orphan")
+    __table_args__ = (db.Index('ix_measurement_type_name', 'name', unique=True),) # Ingest und Web-Worker legen Typen unabhängig voneinander an, der Name darf nur einmal vorkommen
 
 class MeasurementValue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     value = db.Column(db.Float, nullable=False)
     measurement_id = db.Column(db.Integer, db.ForeignKey('measurement.id'), nullable=False)
     measurement_type_id = db.Column(db.Integer, db.ForeignKey('measurement_type.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_mv_type_measurement', 'measurement_type_id', 'measurement_id'),
+        db.Index('ix_mv_measurement', 'measurement_id'), # Für das Laden der Werte einer Messung und das Löschen alter Messungen
+    )
+
+class MeasurementAggregate(db.Model): # Stündliche Zusammenfassung alter Messwerte, die Rohdaten werden danach gelöscht
+    id = db.Column(db.Integer, primary_key=True)
+    sensor_id = db.Column(db.Integer, db.ForeignKey('sensor.id'), nullable=False)
+    measurement_type_id = db.Column(db.Integer, db.ForeignKey('measurement_type.id'), nullable=False)
+    bucket_ts = db.Column(db.DateTime, nullable=False) # Beginn der Stunde
+    value_count = db.Column(db.Integer, nullable=False)
+    value_sum = db.Column(db.Float, nullable=False)
+    value_min = db.Column(db.Float, nullable=False)
+    value_max = db.Column(db.Float, nullable=False)
+    __table_args__ = (db.Index('ix_aggregate_sensor_type_bucket', 'sensor_id', 'measurement_type_id', 'bucket_ts'),)
+
+
+_mt_cache: dict[str, int] = {} # Zwischenspeicher name -> id für MeasurementType, damit nicht bei jedem Wert eine SELECT-Abfrage nötig ist
+_mt_cache_lock = threading.Lock()
+
+def get_measurement_type_id(type_name, conn=None): # conn ist die rohe sqlite3-Verbindung des Hintergrund-Threads, sonst wird die ORM-Session benutzt
+    with _mt_cache_lock:
+        if not _mt_cache: # Beim ersten Aufruf einmalig alle Typen laden
+            rows = conn.execute("SELECT id, name FROM measurement_type") if conn is not None else db.session.query(MeasurementType.id, MeasurementType.name)
+            _mt_cache.update({name: mt_id for mt_id, name in rows})
+        mt_id = _mt_cache.get(type_name)
+        if mt_id is None: # Ein anderer Prozess kann den Typ schon angelegt haben, daher nur einfügen wenn er fehlt und danach die ID lesen
+            if conn is not None:
+                conn.execute(INS_MT, (type_name, 'unit'))
+                mt_id = conn.execute(SEL_MT, (type_name,)).fetchone()[0]
+            else:
+                db.session.execute(sqlite_insert(MeasurementType).values(name=type_name, unit='unit').on_conflict_do_nothing(index_elements=['name'])) # Standard als Platzhalter, kann später angepasst werden
+                mt_id = db.session.execute(select(MeasurementType.id).filter_by(name=type_name)).scalar_one()
+            _mt_cache[type_name] = mt_id
+        return mt_id
+
+# Vorbereitete Statements für den Hintergrund-Thread, der ohne ORM direkt über sqlite3 schreibt
+INS_M = "INSERT INTO measurement(sensor_id, timestamp) VALUES(?, ?)"
+INS_MV = "INSERT INTO measurement_value(value, measurement_id, measurement_type_id) VALUES(?, ?, ?)"
+INS_MT = "INSERT INTO measurement_type(name, unit) VALUES(?, ?) ON CONFLICT(name) DO NOTHING"
+SEL_MT = "SELECT id FROM measurement_type WHERE name = ?"
+
+RETENTION_DAYS = 7 # Rohdaten älter als das werden zu Stundenwerten zusammengefasst
+COMPACTION_INTERVAL = 3600 # Sekunden zwischen zwei Zusammenfassungen
+
+INS_AGG = """
+    INSERT INTO measurement_aggregate(sensor_id, measurement_type_id, bucket_ts, value_count, value_sum, value_min, value_max)
+    SELECT m.sensor_id, mv.measurement_type_id, strftime('%Y-%m-%d %H:00:00.000000', m.timestamp), COUNT(*), SUM(mv.value), MIN(mv.value), MAX(mv.value)
+    FROM measurement m JOIN measurement_value mv ON mv.measurement_id = m.id
+    WHERE m.timestamp < ?
+    GROUP BY m.sensor_id, mv.measurement_type_id, strftime('%Y-%m-%d %H:00:00.000000', m.timestamp)
+"""
+DEL_MV_OLD = "DELETE FROM measurement_value WHERE measurement_id IN (SELECT id FROM measurement WHERE timestamp < ?)"
+DEL_M_OLD = "DELETE FROM measurement WHERE timestamp < ?"
+
+EXPORT_DIR = os.path.join(app.instance_path, 'data') # Spaltenweise Parquet-Dateien pro Sensor und Messgrösse für die Diagramme
+EXPORT_INTERVAL = 24 * 3600 # Einmal pro Tag exportieren
+
+SEL_EXPORT_PAIRS = """
+    SELECT sensor_id, measurement_type_id FROM measurement_aggregate
+    UNION
+    SELECT m.sensor_id, mv.measurement_type_id FROM measurement m JOIN measurement_value mv ON mv.measurement_id = m.id
+"""
+SEL_EXPORT_SERIES = """
+    SELECT bucket_ts, value_sum / value_count FROM measurement_aggregate WHERE sensor_id = ? AND measurement_type_id = ?
+    UNION ALL
+    SELECT m.timestamp, mv.value FROM measurement m JOIN measurement_value mv ON mv.measurement_id = m.id WHERE m.sensor_id = ? AND mv.measurement_type_id = ?
+    ORDER BY 1
+"""
+
+_ingest_conn = None
 
+def get_ingest_connection():
+    global _ingest_conn
+    if _ingest_conn is None: # Eine einzige, dauerhaft offene Verbindung statt bei jedem Durchlauf eine aus dem Pool zu holen
+        _ingest_conn = sqlite3.connect(db.engine.url.database, check_same_thread=False, isolation_level=None) # isolation_level=None, damit wir BEGIN/COMMIT selbst steuern
+        set_sqlite_pragmas(_ingest_conn, None)
+    return _ingest_conn
+
+def compact_measurements(conn, retention_days=RETENTION_DAYS):
+    cutoff = (datetime.now() - timedelta(days=retention_days)).replace(minute=0, second=0, microsecond=0) # Auf volle Stunde runden, damit jede Stunde nur einmal zusammengefasst wird
+    params = (cutoff.strftime('%Y-%m-%d %H:%M:%S.%f'),)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(INS_AGG, params)
+        conn.execute(DEL_MV_OLD, params)
+        deleted = conn.execute(DEL_M_OLD, params).rowcount
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    print(f"Compacted {deleted} measurements older than {cutoff}")
+
+def parquet_path(sensor_id, measurement_type_id):
+    return os.path.join(EXPORT_DIR, f"sensor_{sensor_id}_{measurement_type_id}.parquet")
+
+def remove_parquet_files(sensor_ids):
+    for sensor_id in sensor_ids: # Sonst könnte ein neuer Sensor mit wiederverwendeter ID den Verlauf des gelöschten anzeigen
+        for path in glob.glob(os.path.join(EXPORT_DIR, f"sensor_{sensor_id}_*.parquet")):
+            os.remove(path)
+
+def export_parquet(conn):
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    written = set()
+    for sensor_id, measurement_type_id in conn.execute(SEL_EXPORT_PAIRS).fetchall():
+        rows = conn.execute(SEL_EXPORT_SERIES, (sensor_id, measurement_type_id, sensor_id, measurement_type_id)).fetchall()
+        table = pa.table({
+            "timestamp": pa.array([datetime.fromisoformat(t) for t, _ in rows], type=pa.timestamp('us')),
+            "value": pa.array([v for _, v in rows], type=pa.float64()),
+        })
+        path = parquet_path(sensor_id, measurement_type_id)
+        pq.write_table(table, path + ".tmp")
+        os.replace(path + ".tmp", path) # Atomar ersetzen, damit sensor_detail nie eine halb geschriebene Datei liest
+        written.add(path)
+    for path in set(glob.glob(os.path.join(EXPORT_DIR, "sensor_*.parquet"))) - written: # Dateien ohne Daten mehr (z.B. gelöschte Sensoren) entfernen
+        os.remove(path)
+    print(f"Exported parquet files to {EXPORT_DIR}")
+
+rng = np.random.default_rng() # Ein Zufallsgenerator für den /test Endpunkt, erzeugt alle Werte in einem Aufruf
+
+_stop = threading.Event() # Wird beim Beenden gesetzt (siehe Signal-Handler in ingest.py), damit die Schleife sauber aufhört
 
 def background_task(interval_seconds=60):
+    global _aio_loop, _aio_session, _ingest_conn
     with app.app_context(): # Wird gebraucht, damit der Thread Zugriff auf die Flask-App und die Datenbank hat
-        while True:
-            get_measurements()
-            threading.Event().wait(interval_seconds)  # Wartet 60 Sekunden vor dem nächsten Durchlaufen
+        try:
+            last_compaction = None
+            last_export = None
+            while True:
+                try:
+                    get_measurements()
+                except Exception as e: # z.B. "database is locked" wenn ein Web-Worker länger schreibt, nächster Versuch beim nächsten Durchlauf
+                    print(f"Error getting measurements: {e}")
+                if last_compaction is None or time.monotonic() - last_compaction >= COMPACTION_INTERVAL:
+                    try:
+                        compact_measurements(get_ingest_connection())
+                    except Exception as e: # Ein Fehler hier darf die Sensorabfragen nicht beenden, nächster Versuch beim nächsten Intervall
+                        print(f"Error compacting measurements: {e}")
+                    last_compaction = time.monotonic()
+                if last_export is None or time.monotonic() - last_export >= EXPORT_INTERVAL:
+                    try:
+                        export_parquet(get_ingest_connection())
+                    except Exception as e:
+                        print(f"Error exporting parquet files: {e}")
+                    last_export = time.monotonic()
+                if _stop.wait(interval_seconds):  # Wartet 60 Sekunden vor dem nächsten Durchlaufen, bricht sofort ab wenn _stop gesetzt wird
+                    break
+        finally: # Aufräumen auch wenn die Schleife mit einer Exception endet
+            if _aio_session is not None:
+                _aio_loop.run_until_complete(_aio_session.close())
+                _aio_session = None
+            if _aio_loop is not None:
+                _aio_loop.close()
+                _aio_loop = None
+            if _ingest_conn is not None:
+                _ingest_conn.close()
+                _ingest_conn = None
+            db.session.remove()
+
+async def fetch_sensor_json(session, sensor, timeout=10):
+    try:
+        async def fetch():
+            async with session.get(sensor.url + sensor.data_endpoint) as response:
+                if response.status != 200:
+                    print(f"Failed to get sensor data: {response.status}")
+                    return None
+                data = orjson.loads(await response.read()) # Direkt aus den Bytes parsen, unabhängig vom Content-Type des Sensors
+                if not isinstance(data, dict): # Nur Objekte mit Messgrössen als Schlüssel sind gültig
+                    print(f"Invalid payload from sensor {sensor.name}: {data!r}")
+                    return None
+                return data
+        return await asyncio.wait_for(fetch(), timeout) # Begrenzt die Wartezeit, damit ein toter Sensor nicht alle anderen aufhält
+    except Exception as e:
+        print(f"Error fetching data for sensor {sensor.name}: {e}")
+        return None
+
+async def fetch_all_sensor_json(sensors):
+    global _aio_session
+    if _aio_session is None or _aio_session.closed: # Session erst im laufenden Loop anlegen und danach wiederverwenden
+        _aio_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32),
+            timeout=aiohttp.ClientTimeout(connect=HTTP_TIMEOUT[0], sock_read=HTTP_TIMEOUT[1]),
+        )
+    return await asyncio.gather(*[fetch_sensor_json(_aio_session, sensor) for sensor in sensors]) # Alle Sensoren gleichzeitig abfragen
+
+def persist_measurement(sensor, data):
+    measurement_id = db.session.execute(insert(Measurement).values(sensor_id=sensor.id).returning(Measurement.id)).scalar_one() # RETURNING liefert die ID direkt, ohne separaten flush
+    rows = []
+    for type_name, value in data.items():
+        if isinstance(value, (int, float)):
+            rows.append({"value": value, "measurement_id": measurement_id, "measurement_type_id": get_measurement_type_id(type_name)})
+        else:
+            print(f"Invalid data type for {type_name}: {value}")
+    if rows:
+        db.session.execute(MeasurementValue.__table__.insert(), rows) # Alle Werte in einem einzigen executemany statt einzeln über das ORM einfügen
+    return measurement_id # Kein Commit hier, der Aufrufer entscheidet wann die Transaktion abgeschlossen wird
 
 def get_measurement(sensor_id):
     sensor = Sensor.query.get(sensor_id)
     if not sensor:
         print(f"Sensor {sensor_id} not found")
         return
-    response = requests.get(sensor.url + sensor.data_endpoint)
+    try:
+        response = HTTP.get(sensor.url + sensor.data_endpoint, timeout=HTTP_TIMEOUT)
+    except requests.RequestException as e:
+        print(f"Error fetching data for sensor {sensor.name}: {e}")
+        return
     if response.status_code != 200:
         print(f"Failed to get sensor data: {response.status_code}")
         return
-    data = response.json()
-    
-    measurement = Measurement(sensor_id=sensor.id)
-    db.session.add(measurement)
-    db.session.flush()  # Stellt sicher, dass "measurement" eine gültigen ID hat, bevor wir MeasurementValue hinzufügen
-    for type_name, value in data.items():
-        if isinstance(value, (int, float)):
-            measurement_type = MeasurementType.query.filter_by(name=type_name).first()
-            if not measurement_type:
-                measurement_type = MeasurementType(name=type_name, unit='unit') # Standard als Platzhalter, kann später angepasst werden
-                db.session.add(measurement_type)
-                db.session.flush()  # Stellt sicher, dass "measurement_type" eine gültigen ID hat
-            measurement_value = MeasurementValue(value=value, measurement_id=measurement.id, measurement_type_id=measurement_type.id)
-            db.session.add(measurement_value)
-        else:
-            print(f"Invalid data type for {type_name}: {value}")
-    db.session.commit()
-    return measurement
+    return persist_measurement(sensor, orjson.loads(response.content)) # orjson ist deutlich schneller als response.json()
+
+def persist_measurements(conn, payloads):
+    results = []
+    value_rows = []
+    conn.execute("BEGIN IMMEDIATE") # Schreibsperre sofort holen, alle Sensoren landen in einer Transaktion
+    try:
+        for sensor, data in payloads:
+            timestamp = datetime.now()
+            measurement_id = conn.execute(INS_M, (sensor.id, timestamp.strftime('%Y-%m-%d %H:%M:%S.%f'))).lastrowid # Gleiches Format wie SQLAlchemy es für DateTime speichert
+            values = []
+            for type_name, value in data.items():
+                if isinstance(value, (int, float)):
+                    value_rows.append((value, measurement_id, get_measurement_type_id(type_name, conn)))
+                    values.append(value)
+                else:
+                    print(f"Invalid data type for {type_name}: {value}")
+            results.append((sensor, timestamp, values))
+        conn.executemany(INS_MV, value_rows) # Alle Werte aller Sensoren mit einem einzigen Statement
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        _mt_cache.clear() # Neu angelegte Typen wurden zurückgerollt, Cache beim nächsten Aufruf neu laden
+        raise
+    return results
+
+def get_aio_loop():
+    global _aio_loop
+    if _aio_loop is None:
+        _aio_loop = asyncio.new_event_loop()
+    return _aio_loop
 
 def get_measurements():
-    for sensor in Sensor.query.all():
-        measurement = get_measurement(sensor.id)
-        if measurement:
-            print(f"Sensor: {sensor.name}, Measurement: {measurement.timestamp}, Values: {[value.value for value in measurement.values]}")
+    sensors = Sensor.query.all()
+    db.session.close() # Die Sensoren sind geladen, die ORM-Verbindung wird für das Schreiben nicht gebraucht
+    payloads = get_aio_loop().run_until_complete(fetch_all_sensor_json(sensors)) # Netzwerkabfragen parallel, Datenbankzugriffe danach sequenziell
+    results = persist_measurements(get_ingest_connection(), [(sensor, data) for sensor, data in zip(sensors, payloads) if data is not None])
+    for sensor, timestamp, values in results:
+        print(f"Sensor: {sensor.name}, Measurement: {timestamp}, Values: {values}")
+
+MEASUREMENT_DEBOUNCE = 0.5 # Sekunden, mehrere Schaltvorgänge in diesem Fenster lösen nur eine Messung aus. Gilt nur pro Prozess, mit mehreren gunicorn-Workern wird nicht workerübergreifend zusammengefasst
+_pending: dict[int, float] = {} # sensor_id -> Zeitpunkt, zu dem die Messung nach dem letzten Schalten fällig ist
+_pending_lock = threading.Lock()
+
+def _debounced_measurement(sensor_id, due):
+    time.sleep(max(0, due - time.monotonic()))
+    with _pending_lock:
+        if _pending.get(sensor_id) != due: # Inzwischen wurde erneut geschaltet, die neuere Messung übernimmt
+            return
+        del _pending[sensor_id]
+    with app.app_context(): # Eigener Thread braucht einen eigenen App-Kontext für die Datenbank
+        try:
+            get_measurement(sensor_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            _mt_cache.clear()
+            print(f"Error measuring sensor {sensor_id} after relay toggle: {e}")
+
+def schedule_measurement(sensor_id):
+    due = time.monotonic() + MEASUREMENT_DEBOUNCE
+    with _pending_lock:
+        _pending[sensor_id] = due
+    threading.Thread(target=_debounced_measurement, args=(sensor_id, due), daemon=True).start()
+
+_STATE = {"on": "1", "off": "0"} # Relais-Zustand -> Wert in der URL
+RELAY_TIMEOUT = (2, 3)
 
 def toggle_relay(sensor, new_state):
+    url = f"{sensor.url}{sensor.relay_endpoint}{_STATE[new_state]}"
     try:
-        response = requests.get(sensor.url + sensor.relay_endpoint + 1 if new_state == "on" else 0)
+        response = RELAY_HTTP.get(url, timeout=RELAY_TIMEOUT)
         if response.status_code == 200:
-            print(f"Successfully set relay to {new_state} for sensor {sensor.name}")
+            print(f"Relay set to {new_state.upper()} for {sensor.name}")
         else:
-            print(f"Failed to set relay for sensor {sensor.name}: {response.status_code}")
+            print(f"Failed to set relay: {response.status_code} {response.text}")
     except Exception as e:
-        print(f"Error toggling relay for sensor {sensor.name}: {e}")
+        print(f"Error toggling relay for {sensor.name}: {e}")
 
 @app.route('/')
 def index():
@@ -125,8 +408,10 @@ def add_home():
 @app.route('/home/<int:home_id>/delete', methods=['GET','POST'])
 def delete_home(home_id):   
     home = Home.query.get_or_404(home_id)
+    sensor_ids = [sensor.id for room in home.rooms for sensor in room.sensors]
     db.session.delete(home)
     db.session.commit()
+    remove_parquet_files(sensor_ids)
     return redirect(url_for("settings"))
 
 @app.route('/room/add/<int:home_id>', methods=['GET', 'POST'])
@@ -141,8 +426,10 @@ def add_room(home_id):
 @app.route('/room/<int:room_id>/delete', methods=['GET','POST'])
 def delete_room(room_id):
     room = Room.query.get_or_404(room_id)
+    sensor_ids = [sensor.id for sensor in room.sensors]
     db.session.delete(room)
     db.session.commit()
+    remove_parquet_files(sensor_ids)
     return redirect(url_for("settings"))
 
 @app.route('/sensor/add/<int:room_id>', methods=['GET', 'POST'])
@@ -162,31 +449,81 @@ def delete_sensor(sensor_id):
     sensor = Sensor.query.get_or_404(sensor_id)
     db.session.delete(sensor)
     db.session.commit()
+    remove_parquet_files([sensor_id])
     return redirect(url_for("settings"))
 
+def query_series(sensor_id, measurement_type_id, since=None):
+    query = (
+        select(Measurement.timestamp, MeasurementValue.value)
+        .join(MeasurementValue, MeasurementValue.measurement_id == Measurement.id)
+        .where(Measurement.sensor_id == sensor_id, MeasurementValue.measurement_type_id == measurement_type_id)
+        .order_by(Measurement.timestamp)
+    ) # Filtert direkt in SQL und liefert nur (Zeitstempel, Wert)-Paare statt ORM-Objekte
+    if since is not None:
+        return db.session.execute(query.where(Measurement.timestamp > since)).all()
+    aggregated_rows = db.session.execute(
+        select(MeasurementAggregate.bucket_ts, MeasurementAggregate.value_sum / MeasurementAggregate.value_count)
+        .where(MeasurementAggregate.sensor_id == sensor_id, MeasurementAggregate.measurement_type_id == measurement_type_id)
+        .order_by(MeasurementAggregate.bucket_ts)
+    ).all() # Ältere Daten liegen nur noch als Stundenmittelwerte vor
+    return aggregated_rows + db.session.execute(query).all() # Die zusammengefassten Stunden sind immer älter als die Rohdaten
+
+def load_series(sensor_id, measurement_type_id):
+    path = parquet_path(sensor_id, measurement_type_id)
+    try:
+        if time.time() - os.path.getmtime(path) >= RETENTION_DAYS * 24 * 3600: # Ältere Exporte könnten Rohdaten enthalten, die inzwischen zusammengefasst wurden
+            return query_series(sensor_id, measurement_type_id)
+        exported = pq.read_table(path).to_pydict() # Verlauf bis zum letzten Export direkt aus der Parquet-Datei
+    except FileNotFoundError: # Kein Export vorhanden, oder der Ingest-Prozess hat die Datei gerade entfernt
+        return query_series(sensor_id, measurement_type_id)
+    rows = list(zip(exported["timestamp"], exported["value"]))
+    since = rows[-1][0] if rows else None
+    return rows + query_series(sensor_id, measurement_type_id, since) # Nur die seit dem Export hinzugekommenen Rohdaten aus SQLite
+
 @app.route('/sensor/<int:sensor_id>')
 def sensor_detail(sensor_id):
     sensor = Sensor.query.get_or_404(sensor_id)# Holt den Sensor oder sendet 404 fehler wenn der sensor nicht findet
     
     property_name = request.args.get('property', 'temperature') # Temperatur als Standardwert falls kein Parameter angegeben wird
     
-    measurements = [] 
-    values = [] 
-    for m in sensor.measurements:
-        mv = next((v for v in m.values if v.measurement_type.name == property_name), None) # Sucht nach dem ersten MeasurementValue dass dem property_name entspricht
-        if mv: # mv steht für MeasurementValue, m ist Measurement
-            measurements.append(m.timestamp.strftime('%Y-%m-%d %H:%M:%S')) # Formatiert Datum und Urzeit
-            values.append(mv.value) 
+    type_names = dict(db.session.execute(select(MeasurementType.id, MeasurementType.name)).all()) # Einmal id -> name laden, danach werden nur noch Integer verglichen
+    relay_type_ids = {mt_id for mt_id, name in type_names.items() if name == 'relay'}
+
+    last_measurement = (
+        Measurement.query.options(selectinload(Measurement.values))
+        .filter_by(sensor_id=sensor_id)
+        .order_by(Measurement.timestamp.desc())
+        .first()
+    ) # Für Relais-Status und Auswahlliste reicht die letzte Messung, der restliche Verlauf wird nicht als ORM-Objekte geladen
+    relay_value = next((v.value for v in last_measurement.values if v.measurement_type_id in relay_type_ids), None) if last_measurement else None
+    if last_measurement:
+        property_type_ids = [v.measurement_type_id for v in last_measurement.values]
+    else: # Alle Rohdaten wurden schon zusammengefasst (Sensor länger offline), die Messgrössen aus den Stundenwerten nehmen
+        property_type_ids = db.session.execute(
+            select(MeasurementAggregate.measurement_type_id).filter_by(sensor_id=sensor_id).distinct()
+        ).scalars().all()
+    property_names = [type_names.get(mt_id) for mt_id in property_type_ids]
+    property_names = [name for name in property_names if name is not None] # Typen, die nach dem Laden von type_names angelegt wurden, fehlen noch
+    
+    relay_pending = request.args.get('pending') == '1' # Direkt nach dem Schalten ist relay_value noch der alte Zustand
     
-    return render_template('sensor_detail.html', sensor=sensor, measurements=measurements, values=values, property_name=property_name)
+    return render_template('sensor_detail.html', sensor=sensor, property_name=property_name, relay_value=relay_value, property_names=property_names, relay_pending=relay_pending)
+
+@app.route('/sensor/<int:sensor_id>/data')
+def sensor_data(sensor_id):
+    Sensor.query.get_or_404(sensor_id) # 404 statt einer leeren Datenreihe für unbekannte Sensoren
+    property_name = request.args.get('property', 'temperature')
+    measurement_type_id = db.session.execute(select(MeasurementType.id).filter_by(name=property_name).order_by(MeasurementType.id)).scalars().first()
+    rows = load_series(sensor_id, measurement_type_id)
+    return jsonify({
+        "t": [int(t.timestamp()) for t, _ in rows], # Unix-Zeitstempel sind deutlich kürzer als formatierte Strings
+        "v": [v for _, v in rows],
+    })
 
 @app.route("/test")
 def test():
-
-    power = round(random.uniform(10, 20), 2)
-    Ws = round(random.uniform(5, 15), 2)
-    relay = random.choice([True, False])
-    temperature = round(random.uniform(20, 30), 2)
+    power, Ws, temperature = np.round(rng.uniform([10, 5, 20], [20, 15, 30]), 2).tolist() # tolist() liefert normale Python-floats für jsonify
+    relay = bool(rng.integers(2))
     return jsonify({
         "power": power,
         "Ws": Ws,
@@ -202,23 +539,13 @@ def toggle_sensor_relay(sensor_id):
     if not sensor.relay_endpoint:
         return f"Sensor {sensor.name} has no relay endpoint configured.", 400
 
-    state_num = "1" if new_state == "on" else "0"
-    url = f"{sensor.url}{sensor.relay_endpoint}{state_num}"
+    if new_state not in _STATE:
+        return f"Invalid relay state: {new_state}", 400
 
-    try:
-        response = requests.get(url)
-        if response.status_code == 200:
-            print(f"Relay set to {new_state.upper()} for {sensor.name}")
-        else:
-            print(f"Failed to set relay: {response.status_code} {response.text}")
-    except Exception as e:
-        print(f"Error toggling relay for {sensor.name}: {e}")
-    get_measurement(sensor.id)  
-    return redirect(url_for("sensor_detail", sensor_id=sensor.id))
+    toggle_relay(sensor, new_state)
+    schedule_measurement(sensor.id) # Messung läuft im Hintergrund, damit die Antwort nicht auf den Sensor warten muss
+    return redirect(url_for("sensor_detail", sensor_id=sensor.id, pending=1)) # Die Messung ist noch nicht gelaufen, die Seite zeigt den Zustand als ausstehend an
 
 
 if __name__ == '__main__':
-    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':  # Verhindert, dass der Thread zweimal gestartet wird (debug mode)
-        thread = threading.Thread(target=background_task, args=(60,), daemon=True)  # Daemon-Thread, damit er im Hintergrund läuft und die App nicht blockiert, schliesst automatisch wenn die App geschlossen wird
-        thread.start()  # Startet den Hintergrund-Thread
-    app.run(debug=True)
+    app.run(debug=True)  # Nur zur Entwicklung, im Betrieb mit gunicorn starten. Die Sensorabfragen laufen separat über ingest.py
@@ -0,0 +1,11 @@
+import signal
+from app import background_task, _stop
+
+# Eigener Prozess für die Sensorabfragen, damit der Webserver nicht mit der Datenerfassung blockiert.
+# Starten mit "python ingest.py", die Webseite separat mit "gunicorn -w 2 -k gthread app:app".
+# Beide greifen nur über SQLite (WAL-Modus) auf dieselben Daten zu.
+
+if __name__ == '__main__':
+    signal.signal(signal.SIGTERM, lambda signum, frame: _stop.set()) # Sauber beenden statt mitten in einer Transaktion abzubrechen
+    signal.signal(signal.SIGINT, lambda signum, frame: _stop.set())
+    background_task(60)